@@ -1,17 +1,18 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
-import pandas as pd
+from typing import List, Optional, Literal, TYPE_CHECKING
 import numpy as np
-# from prophet import Prophet  # Will use pre-trained models from Colab
-import pickle
-import requests
+import importlib
 import logging
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import pandas as pd
+    from prophet import Prophet
+
 # Load environment variables
 load_dotenv()
 
@@ -36,6 +37,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Heavy optional libraries (pandas, prophet) are imported on first use so
+# startup and reloads do not pay for them
+_LAZY_MODULES = {}
+
+def lazy_import(name: str):
+    """Import a module on first use and cache it"""
+    module = _LAZY_MODULES.get(name)
+    if module is None:
+        module = _LAZY_MODULES[name] = importlib.import_module(name)
+    return module
+
 # Pydantic models
 class PredictionRequest(BaseModel):
     commodity: Literal["mustard", "groundnut", "soybean", "sunflower", "sesame"]
@@ -69,8 +81,9 @@ class VolatilityResponse(BaseModel):
     analysis_period_days: int
 
 # Mock historical data (in production, this would come from your database/API)
-def get_mock_historical_data(commodity: str, days: int = 180) -> pd.DataFrame:
+def get_mock_historical_data(commodity: str, days: int = 180) -> "pd.DataFrame":
     """Generate mock historical price data for demonstration"""
+    pd = lazy_import("pandas")
     np.random.seed(42)  # For reproducible results
     
     # Base prices for different commodities (INR per quintal)
@@ -101,8 +114,9 @@ def get_mock_historical_data(commodity: str, days: int = 180) -> pd.DataFrame:
     
     return df
 
-def train_prophet_model(data: pd.DataFrame) -> Prophet:
+def train_prophet_model(data: "pd.DataFrame") -> "Prophet":
     """Train Prophet model with historical data"""
+    Prophet = lazy_import("prophet").Prophet
     model = Prophet(
         daily_seasonality=False,
         weekly_seasonality=True,
@@ -2,13 +2,17 @@ import { NextResponse } from "next/server";
 
 const ML_SERVICE_URL = process.env.ML_SERVICE_URL || "http://localhost:8000";
 
-export async function GET() {
+export async function GET(request: Request) {
   try {
+    // Forward the caller's address so the ML service rate-limits per user, not per proxy
+    const forwardedFor = request.headers.get("x-forwarded-for");
+
     // Call the Python ML service
     const response = await fetch(`${ML_SERVICE_URL}/forecast?crop=soybean`, {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
+        ...(forwardedFor ? { "X-Forwarded-For": forwardedFor } : {}),
       },
       // Add a timeout to prevent hanging
       signal: AbortSignal.timeout(5000),
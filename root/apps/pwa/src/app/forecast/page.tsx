@@ -64,14 +64,24 @@ interface PredictionPoint {
   confidence: number;
 }
 
+interface BacktestSummary {
+  method: string;
+  horizon_days: number;
+  origins: number;
+  mae_vs_naive: number | null;
+}
+
+// Error metrics come from the ML service's walk-forward backtest and are
+// null until the commodity has been backtested
 interface ModelMetrics {
   model: string;
-  accuracy: number;
+  mape: number | null;
   confidence: number;
-  rmse: number;
-  mae: number;
+  rmse: number | null;
+  mae: number | null;
   trend: 'Bullish' | 'Bearish' | 'Neutral';
   volatility: 'Low' | 'Medium' | 'High';
+  backtest?: BacktestSummary | null;
 }
 
 interface ChartDataPoint {
@@ -614,25 +624,24 @@ export default function ForecastPage() {
                 <div className="mb-4">
                   <p className="text-sm text-gray-600 mb-2">{metrics.model}</p>
                   <div className="flex justify-between items-center mb-2">
-                    <span className="text-sm font-semibold text-gray-700">Accuracy</span>
-                    <span className="text-sm font-bold text-green-600">{metrics.accuracy.toFixed(1)}%</span>
+                    <span className="text-sm font-semibold text-gray-700">Backtest MAPE</span>
+                    <span className="text-sm font-bold text-green-600">{formatMetric(metrics.mape, 3, '%')}</span>
                   </div>
-                  <div className="w-full bg-gray-200 rounded-full h-3">
-                    <div 
-                      className="bg-gradient-to-r from-green-500 to-emerald-600 h-3 rounded-full transition-all duration-500"
-                      style={{ width: `${metrics.accuracy}%` }}
-                    />
+                  <div className="flex justify-between items-center">
+                    <span className="text-sm font-semibold text-gray-700">Error vs. naive forecast</span>
+                    <span className="text-sm font-bold text-gray-900">{formatMetric(metrics.backtest?.mae_vs_naive, 2, '×')}</span>
                   </div>
+                  <p className="text-xs text-gray-500 mt-1">Below 1× beats carrying the last price forward</p>
                 </div>
                 
                 <div className="grid grid-cols-2 gap-3">
                   <div className="bg-gray-50 rounded-xl p-4">
                     <p className="text-xs text-gray-600 mb-1">RMSE</p>
-                    <p className="font-bold text-gray-900">{metrics.rmse.toFixed(2)}</p>
+                    <p className="font-bold text-gray-900">{formatMetric(metrics.rmse, 2)}</p>
                   </div>
                   <div className="bg-gray-50 rounded-xl p-4">
                     <p className="text-xs text-gray-600 mb-1">MAE</p>
-                    <p className="font-bold text-gray-900">{metrics.mae.toFixed(2)}</p>
+                    <p className="font-bold text-gray-900">{formatMetric(metrics.mae, 2)}</p>
                   </div>
                 </div>
               </>
@@ -723,6 +732,10 @@ function transformForecastToPredictions(forecastData: any, historicalData: Histo
   return predictions;
 }
 
+function formatMetric(value: number | null | undefined, digits: number, suffix = ''): string {
+  return value === null || value === undefined ? '—' : `${value.toFixed(digits)}${suffix}`;
+}
+
 function calculateMetrics(forecastData: any, historicalData: HistoricalDataPoint[]): ModelMetrics {
   const horizon7 = forecastData?.horizons?.find((h: any) => h.days === 7);
   const currentPrice = forecastData?.current_price || historicalData[historicalData.length - 1]?.price || 4250;
@@ -738,10 +751,11 @@ function calculateMetrics(forecastData: any, historicalData: HistoricalDataPoint
   
   return {
     model: 'Prophet + ARIMA Ensemble',
-    accuracy: 78.5 + Math.random() * 10,
+    // The /forecast fallback carries no backtest, so there are no error metrics to show
+    mape: null,
     confidence: 82.3 + Math.random() * 5,
-    rmse: 45.2 + Math.random() * 20,
-    mae: 32.1 + Math.random() * 15,
+    rmse: null,
+    mae: null,
     trend,
     volatility,
   };